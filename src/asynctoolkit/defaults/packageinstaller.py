@@ -1,10 +1,82 @@
-from typing import Optional
+from typing import Optional, Set, Tuple, Union
+import functools
 import importlib
+import importlib.metadata
+import importlib.util
+import logging
+import os
+import re
 import sys
 import asyncio
 
 from ..base import register_tool, ExtendableTool
 
+logger = logging.getLogger("asynctoolkit.defaults.packageinstaller")
+
+# First characters of version specifiers that already carry an operator.
+_VERSION_OPS = frozenset("=<>!~")
+
+
+def _normalize_name(name: str) -> str:
+    """
+    Normalize a distribution name as described in PEP 503.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+# Normalized names of the installed distributions, read on first use.
+_INSTALLED_NAMES: Optional[Set[str]] = None
+
+
+def _installed_names() -> Set[str]:
+    """
+    Return the normalized names of all installed distributions.
+
+    The names are read once and reused until _reset_installed_names() is
+    called, which installers do after changing the environment. Packages
+    installed or removed by other means are not reflected, so a name found
+    here still has to be confirmed before relying on it.
+    """
+    global _INSTALLED_NAMES
+    if _INSTALLED_NAMES is None:
+        _INSTALLED_NAMES = {
+            _normalize_name(dist.name)
+            for dist in importlib.metadata.distributions()
+            if dist.name
+        }
+    return _INSTALLED_NAMES
+
+
+def _reset_installed_names() -> None:
+    """
+    Forget the installed names so the next lookup reads them again.
+    """
+    global _INSTALLED_NAMES
+    _INSTALLED_NAMES = None
+
+
+def _top_level_modules(dist: importlib.metadata.Distribution) -> Tuple[str, ...]:
+    """
+    Return the top-level modules listed in the distribution's top_level.txt.
+    """
+    return tuple((dist.read_text("top_level.txt") or "").splitlines())
+
+
+def _reload_modules(modules) -> None:
+    """
+    Reload modules one after another. A module that fails to reload is
+    logged and skipped, so the remaining modules are still reloaded.
+
+    This runs on the calling (event loop) thread on purpose: module code
+    that needs the main thread or the running loop, such as signal.signal()
+    or asyncio.get_event_loop(), would fail in a worker thread.
+    """
+    for module in modules:
+        try:
+            importlib.reload(module)
+        except Exception:
+            logger.warning("Could not reload module %r", module.__name__, exc_info=True)
+
 
 class PackageInstallerTool(ExtendableTool[None]):
     async def run(
@@ -13,33 +85,37 @@ class PackageInstallerTool(ExtendableTool[None]):
         version: Optional[str] = None,
         upgrade: bool = False,
         extension=None,
+        cache_dir: Optional[Union[str, os.PathLike]] = None,
     ):
-        # If a specific version is requested, modify the command accordingly.
-        if version:
-            # If the version string already starts with a comparison operator, use it directly.
-            if version[0] in ("=", "<", ">", "!"):
-                version = version
-            else:
-                version = "==" + version
+        # If a specific version is requested without a comparison operator,
+        # pin it exactly.
+        if version and version[:1] not in _VERSION_OPS:
+            version = "==" + version
+
+        kwargs = {}
+        # Only forwarded when set, as not every extension supports a cache.
+        if cache_dir is not None:
+            kwargs["cache_dir"] = cache_dir
 
         res = await super().run(
             package_name=package_name,
             version=version,
             upgrade=upgrade,
             extension=extension,
+            **kwargs,
         )
 
         if upgrade:
             # Reload the top-level modules of the package.
             try:
                 dist = importlib.metadata.distribution(package_name)
-                top_level_modules = dist.read_text("top_level.txt").splitlines()
-                for mod in top_level_modules:
-                    if mod in sys.modules:
-                        try:
-                            importlib.reload(sys.modules[mod])
-                        except Exception:
-                            pass
+                top_level_modules = _top_level_modules(dist)
+                loaded_modules = [
+                    module
+                    for module in map(sys.modules.get, top_level_modules)
+                    if module is not None
+                ]
+                _reload_modules(loaded_modules)
             except Exception:
                 pass
 
@@ -47,63 +123,92 @@ class PackageInstallerTool(ExtendableTool[None]):
 
 
 # Micropip Extension
-try:  # pragma: no cover - only available in Pyodide
+# micropip only exists in Pyodide, so other interpreters skip the import attempt.
+async def micropip_install(
+    package_name: str,
+    version: Optional[str] = None,
+    upgrade: bool = False,
+):
     import micropip
 
-    async def micropip_install(  # pragma: no cover - only available in Pyodide
-        package_name: str,
-        version: Optional[str] = None,
-        upgrade: bool = False,
-    ):
-        # Check if the package is already installed.
+    # Check if the package is already installed. The snapshot does not see
+    # packages installed or removed by other means, so confirm a hit against
+    # the installed metadata. A miss is only trusted for plain installs;
+    # with a version or upgrade a wrongly skipped uninstall would leave the
+    # old version in place.
+    if version or upgrade or _normalize_name(package_name) in _installed_names():
         try:
             importlib.metadata.distribution(package_name)
-            if upgrade:
-                micropip.uninstall(package_name)
-            else:
-                return
         except importlib.metadata.PackageNotFoundError:
             pass
+        else:
+            if not upgrade:
+                return
+            micropip.uninstall(package_name)
+            _reset_installed_names()
+
+    if version:
+        package_name = f"{package_name}{version}"
+    await micropip.install(package_name)
+    # micropip may have installed dependencies as well, so read all names
+    # again on the next lookup.
+    _reset_installed_names()
+
+
+def _register_micropip() -> None:
+    """
+    Register the micropip extension when running in Pyodide.
+    """
+    if sys.platform == "emscripten" and importlib.util.find_spec("micropip"):
+        PackageInstallerTool.register_extension("micropip", micropip_install)
 
-        if version:
-            package_name = f"{package_name}{version}"
-        await micropip.install(package_name)
 
-    if sys.platform == "emscripten":  # pragma: no cover - only available in Pyodide
-        PackageInstallerTool.register_extension("micropip", micropip_install)
-except ImportError:  # pragma: no cover - optional dependency
-    pass  # pragma: no cover - optional dependency
+_register_micropip()
 
 
 # Pip Extension
-try:
-
-    async def pip_install(
-        package_name: str,
-        version: Optional[str] = None,
-        upgrade: bool = False,
-    ):
-        if version:
-            package_name = f'"{package_name}{version}"'
-        args = ["install", package_name] + (["--upgrade"] if upgrade else [])
-        # Run pip_main in a separate thread to avoid blocking the event loop.
-        cmd = [sys.executable, "-m", "pip"] + args
-        print(
-            " ".join(cmd),
-        )
-        proc = await asyncio.create_subprocess_shell(
-            " ".join(cmd),
-            stderr=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
+@functools.lru_cache(maxsize=1)
+def _has_pip() -> bool:
+    """
+    Check once, without importing it, whether pip is available.
+    """
+    return importlib.util.find_spec("pip") is not None
+
+
+async def pip_install(
+    package_name: str,
+    version: Optional[str] = None,
+    upgrade: bool = False,
+    cache_dir: Optional[Union[str, os.PathLike]] = None,
+):
+    if not _has_pip():
+        raise ImportError("pip is not available in this environment.")
+    # Run pip in a subprocess to avoid blocking the event loop. The
+    # arguments are passed as a list, so no shell quoting is needed.
+    requirement = package_name + (version or "")
+    cmd = [sys.executable, "-m", "pip", "install", requirement]
+    if upgrade:
+        cmd.append("--upgrade")
+    if cache_dir is not None:
+        cmd += ["--cache-dir", os.fspath(cache_dir)]
+    logger.info("Running %s", " ".join(cmd))
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stderr=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+
+    stdout, stderr = await proc.communicate()
+    logger.debug("pip stdout:\n%s", stdout.decode(errors="replace"))
+    logger.debug("pip stderr:\n%s", stderr.decode(errors="replace"))
+    if proc.returncode != 0:
+        raise RuntimeError(
+            f"pip install {requirement!r} failed with exit code "
+            f"{proc.returncode}:\n{stderr.decode(errors='replace')}"
         )
 
-        stdout, stderr = await proc.communicate()
-        print(stdout.decode())
-        print(stderr.decode())
 
-    PackageInstallerTool.register_extension("pip", pip_install)
-except ImportError:  # pragma: no cover - optional dependency
-    pass  # pragma: no cover - optional dependency
+PackageInstallerTool.register_extension("pip", pip_install)
 
 
 register_tool("packageinstaller", PackageInstallerTool)
@@ -0,0 +1,9 @@
+import importlib.util
+from pathlib import Path
+
+# The Pyodide integration tests need pytest-pyodide and a local Pyodide
+# distribution in the repository root.
+HAS_PYODIDE_TEST = (
+    importlib.util.find_spec("pytest_pyodide") is not None
+    and (Path(__file__).resolve().parents[2] / "pyodide").exists()
+)
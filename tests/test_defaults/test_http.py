@@ -1,7 +1,7 @@
+import importlib.util
 import io
 import json
 import uuid
-from pathlib import Path
 from contextlib import asynccontextmanager
 
 import pytest
@@ -9,40 +9,13 @@ import pytest
 from asynctoolkit.base import run_tool
 from asynctoolkit.defaults.http import AsyncResponse, HTTPTool
 
-try:  # Optional backends
-    import aiohttp
+from ._pyodide import HAS_PYODIDE_TEST
 
-    HAS_AIOHTTP = True
-except ImportError:  # pragma: no cover - best effort environment detection
-    HAS_AIOHTTP = False
+# Optional backends; find_spec avoids importing them during collection.
+HAS_AIOHTTP = importlib.util.find_spec("aiohttp") is not None
+HAS_REQUESTS = importlib.util.find_spec("requests") is not None
+HAS_HTTPX = importlib.util.find_spec("httpx") is not None
 
-try:
-    import requests
-
-    HAS_REQUESTS = True
-except ImportError:  # pragma: no cover
-    HAS_REQUESTS = False
-
-try:
-    import httpx
-
-    HAS_HTTPX = True
-except ImportError:  # pragma: no cover
-    HAS_HTTPX = False
-
-try:
-    import pyodide
-
-    HAS_PYODIDE = True
-except ImportError:  # pragma: no cover
-    HAS_PYODIDE = False
-
-try:  # Optional Pyodide integration tests
-    from pytest_pyodide import copy_files_to_pyodide, run_in_pyodide
-
-    HAS_PYODIDE_TEST = (Path(__file__).parent.parent.parent / "pyodide").exists()
-except ImportError:  # pragma: no cover
-    HAS_PYODIDE_TEST = False
 
 
 def _extensions():
@@ -72,17 +45,20 @@ class _DummyAsyncResponse(AsyncResponse):
         super().__init__("http://example", None)
         self._status = status
         self._reason = reason
-        self._body = body
         self._headers = headers or {}
+        if isinstance(body, bytes):
+            self._text = body.decode("utf-8", errors="ignore")
+            self._content_bytes = body
+        else:
+            self._text = str(body)
+            self._content_bytes = self._text.encode()
 
     async def text(self) -> str:
-        if isinstance(self._body, bytes):
-            return self._body.decode("utf-8", errors="ignore")
-        return str(self._body)
+        return self._text
 
     async def json(self):
         try:
-            return json.loads(await self.text())
+            return json.loads(self._text)
         except json.JSONDecodeError:
             return {}
 
@@ -96,12 +72,12 @@ class _DummyAsyncResponse(AsyncResponse):
         return self._reason
 
     async def iter_content(self, chunk_size: int = 1024):
-        yield self._body
+        view = memoryview(self._content_bytes)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start : start + chunk_size])
 
     async def content(self) -> bytes:
-        if isinstance(self._body, bytes):
-            return self._body
-        return str(self._body).encode()
+        return self._content_bytes
 
 
 @pytest.mark.asyncio
@@ -215,6 +191,13 @@ async def test_async_response_raise_for_status_decodes_bytes_reason():
     assert "ÿ" in str(excinfo.value)
 
 
+@pytest.mark.asyncio
+async def test_dummy_response_iter_content_chunks():
+    response = _DummyAsyncResponse(body=b"abcdefghijk")
+    chunks = [chunk async for chunk in response.iter_content(5)]
+    assert chunks == [b"abcde", b"fghij", b"k"]
+
+
 @pytest.mark.asyncio
 async def test_http_tool_forwards_request_kwargs():
     captured = []
@@ -366,16 +349,18 @@ async def test_http_aiohttp_timeout_fallback(monkeypatch, httpserver):
 
 
 if HAS_PYODIDE_TEST:
+    from pytest_pyodide import copy_files_to_pyodide, run_in_pyodide
 
-    @copy_files_to_pyodide(
+    # Shared by all Pyodide tests below.
+    copy_asynctoolkit = copy_files_to_pyodide(
         file_list=[("src/asynctoolkit", "asynctoolkit")],
         install_wheels=True,
         recurse_directories=True,
     )
+
+    @copy_asynctoolkit
     @run_in_pyodide
     async def test_http_tool_extension_pyodide(selenium):
-        import os
-
         from asynctoolkit.base import run_tool
 
         TEST_URL = "https://httpbin.org/get"
@@ -393,15 +378,9 @@ if HAS_PYODIDE_TEST:
             assert "url" in data
             assert data["url"].startswith(TEST_URL)
 
-    @copy_files_to_pyodide(
-        file_list=[("src/asynctoolkit", "asynctoolkit")],
-        install_wheels=True,
-        recurse_directories=True,
-    )
+    @copy_asynctoolkit
     @run_in_pyodide
     async def test_http_raise_for_pyodide(selenium):
-        import os
-
         from asynctoolkit.base import run_tool
         from asynctoolkit.defaults.http import AsyncResponse
 
@@ -419,15 +398,9 @@ if HAS_PYODIDE_TEST:
             except AsyncResponse.HTTPError:
                 pass
 
-    @copy_files_to_pyodide(
-        file_list=[("src/asynctoolkit", "asynctoolkit")],
-        install_wheels=True,
-        recurse_directories=True,
-    )
+    @copy_asynctoolkit
     @run_in_pyodide
     async def test_http_iter_content_pyodide(selenium):
-        import os
-
         from asynctoolkit.base import run_tool
 
         TEST_URL = "https://httpbin.org/get"
@@ -1,20 +1,16 @@
 import asyncio
 import importlib
+import importlib.machinery
 import importlib.metadata
 import sys
 import types
-from pathlib import Path
 
 import pytest
 
+from asynctoolkit.defaults import packageinstaller
 from asynctoolkit.defaults.packageinstaller import PackageInstallerTool
 
-try:
-    from pytest_pyodide import copy_files_to_pyodide, run_in_pyodide
-
-    HAS_PYODIDE_TEST = (Path(__file__).parent.parent.parent / "pyodide").exists()
-except ImportError:  # pragma: no cover - only available in CI environments
-    HAS_PYODIDE_TEST = False
+from ._pyodide import HAS_PYODIDE_TEST
 
 
 @pytest.fixture()
@@ -43,9 +39,11 @@ async def test_package_installer_version_prefix(recorded_installer):
     tool = PackageInstallerTool()
     await tool.run("demo", version="0.1.0", extension="test-installer")
     await tool.run("demo", version=">=0.2.0", extension="test-installer")
+    await tool.run("demo", version="~=0.3", extension="test-installer")
 
     assert recorded_installer[0]["version"] == "==0.1.0"
     assert recorded_installer[1]["version"] == ">=0.2.0"
+    assert recorded_installer[2]["version"] == "~=0.3"
 
 
 @pytest.mark.asyncio
@@ -55,9 +53,7 @@ async def test_package_installer_upgrade_reload(monkeypatch, recorded_installer)
     sys.modules["reload_me"] = module
 
     class DummyDist:
-        def read_text(self, name):
-            assert name == "top_level.txt"
-            return "reload_me\n"
+        pass
 
     reloaded = []
 
@@ -66,6 +62,9 @@ async def test_package_installer_upgrade_reload(monkeypatch, recorded_installer)
         return mod
 
     monkeypatch.setattr(importlib.metadata, "distribution", lambda pkg: DummyDist())
+    monkeypatch.setattr(
+        packageinstaller, "_top_level_modules", lambda dist: ("reload_me",)
+    )
     monkeypatch.setattr(importlib, "reload", fake_reload)
 
     await tool.run(
@@ -82,18 +81,20 @@ async def test_package_installer_upgrade_reload(monkeypatch, recorded_installer)
 
 
 @pytest.mark.asyncio
-async def test_package_installer_reload_errors_are_swallowed(
-    monkeypatch, recorded_installer
+async def test_package_installer_reload_errors_are_logged(
+    monkeypatch, caplog, recorded_installer
 ):
     tool = PackageInstallerTool()
     module = types.ModuleType("reload_fail")
     sys.modules["reload_fail"] = module
 
     class DummyDist:
-        def read_text(self, name):
-            return "reload_fail\n"
+        pass
 
     monkeypatch.setattr(importlib.metadata, "distribution", lambda pkg: DummyDist())
+    monkeypatch.setattr(
+        packageinstaller, "_top_level_modules", lambda dist: ("reload_fail",)
+    )
 
     def failing_reload(mod):
         raise RuntimeError("boom")
@@ -106,25 +107,180 @@ async def test_package_installer_reload_errors_are_swallowed(
         extension="test-installer",
     )
 
+    assert "Could not reload module 'reload_fail'" in caplog.text
+
     sys.modules.pop("reload_fail", None)
 
 
 @pytest.mark.asyncio
-async def test_package_installer_pip_invocation(monkeypatch):
-    captured = {}
+async def test_package_installer_upgrade_ignores_missing_distribution(
+    monkeypatch, recorded_installer
+):
+    monkeypatch.setitem(sys.modules, "missing_dist", types.ModuleType("missing_dist"))
+
+    def missing_distribution(pkg):
+        raise importlib.metadata.PackageNotFoundError(pkg)
+
+    monkeypatch.setattr(importlib.metadata, "distribution", missing_distribution)
+
+    await PackageInstallerTool().run(
+        "missing_dist",
+        upgrade=True,
+        extension="test-installer",
+    )
+
+    assert recorded_installer[-1]["upgrade"] is True
+
+
+def test_package_installer_installed_names():
+    assert packageinstaller._normalize_name("Foo_Bar.baz") == "foo-bar-baz"
+
+    names = packageinstaller._installed_names()
+    assert "pytest" in names
+    assert packageinstaller._installed_names() is names
+
+    packageinstaller._reset_installed_names()
+    assert packageinstaller._installed_names() is not names
+
 
-    class DummyProcess:
-        def __init__(self, command):
-            captured["command"] = command
+def test_package_installer_top_level_modules(tmp_path):
+    dist_info = tmp_path / "top_level_demo-1.0.dist-info"
+    dist_info.mkdir()
+    dist = importlib.metadata.PathDistribution(dist_info)
+    assert packageinstaller._top_level_modules(dist) == ()
+
+    (dist_info / "top_level.txt").write_text("first\nsecond\n")
+    assert packageinstaller._top_level_modules(dist) == ("first", "second")
+
+
+@pytest.fixture()
+def fake_micropip(monkeypatch):
+    """
+    Pretend to run in Pyodide with a micropip that records its calls.
+    """
+    micropip = types.ModuleType("micropip")
+    micropip.__spec__ = importlib.machinery.ModuleSpec("micropip", None)
+    micropip.calls = []
+
+    async def install(requirement):
+        micropip.calls.append(("install", requirement))
+
+    def uninstall(package_name):
+        micropip.calls.append(("uninstall", package_name))
+
+    micropip.install = install
+    micropip.uninstall = uninstall
+    monkeypatch.setitem(sys.modules, "micropip", micropip)
+    monkeypatch.setattr(sys, "platform", "emscripten")
+    monkeypatch.setattr(PackageInstallerTool, "_extensions", {})
+    packageinstaller._register_micropip()
+    return micropip
+
+
+@pytest.fixture()
+def installed_urllib3(monkeypatch):
+    """
+    Make urllib3 look installed, both in the snapshot and in the metadata.
+    """
+    monkeypatch.setattr(packageinstaller, "_INSTALLED_NAMES", {"urllib3"})
+    monkeypatch.setattr(importlib.metadata, "distribution", lambda pkg: object())
+
+
+@pytest.mark.asyncio
+async def test_package_installer_micropip_install(monkeypatch, fake_micropip):
+    def missing_distribution(pkg):
+        raise importlib.metadata.PackageNotFoundError(pkg)
+
+    monkeypatch.setattr(packageinstaller, "_INSTALLED_NAMES", set())
+    monkeypatch.setattr(importlib.metadata, "distribution", missing_distribution)
+
+    await PackageInstallerTool().run("urllib3", version="2.0.0")
+
+    assert fake_micropip.calls == [("install", "urllib3==2.0.0")]
+    assert packageinstaller._INSTALLED_NAMES is None
+
+
+@pytest.mark.asyncio
+async def test_package_installer_micropip_skips_installed(
+    fake_micropip, installed_urllib3
+):
+    await PackageInstallerTool().run("urllib3", version="2.0.0")
+
+    assert fake_micropip.calls == []
+
+
+@pytest.mark.asyncio
+async def test_package_installer_micropip_stale_snapshot_hit(
+    monkeypatch, fake_micropip
+):
+    def missing_distribution(pkg):
+        raise importlib.metadata.PackageNotFoundError(pkg)
+
+    monkeypatch.setattr(packageinstaller, "_INSTALLED_NAMES", {"urllib3"})
+    monkeypatch.setattr(importlib.metadata, "distribution", missing_distribution)
+
+    await PackageInstallerTool().run("urllib3")
+
+    assert fake_micropip.calls == [("install", "urllib3")]
+
+
+@pytest.mark.asyncio
+async def test_package_installer_micropip_upgrade(fake_micropip, installed_urllib3):
+    await PackageInstallerTool().run("urllib3", version="2.0.0", upgrade=True)
+
+    assert fake_micropip.calls == [
+        ("uninstall", "urllib3"),
+        ("install", "urllib3==2.0.0"),
+    ]
+    assert packageinstaller._INSTALLED_NAMES is None
+
+
+@pytest.mark.asyncio
+async def test_package_installer_micropip_stale_snapshot_miss(
+    monkeypatch, fake_micropip
+):
+    # urllib3 was installed behind the snapshot's back, e.g. as a dependency.
+    monkeypatch.setattr(packageinstaller, "_INSTALLED_NAMES", set())
+    monkeypatch.setattr(importlib.metadata, "distribution", lambda pkg: object())
+
+    tool = PackageInstallerTool()
+    await tool.run("urllib3", version="2.0.0")
+    assert fake_micropip.calls == []
+
+    await tool.run("urllib3", version="2.0.0", upgrade=True)
+    assert fake_micropip.calls == [
+        ("uninstall", "urllib3"),
+        ("install", "urllib3==2.0.0"),
+    ]
+
+
+@pytest.fixture()
+def pip_process(monkeypatch):
+    """
+    Replace the pip subprocess; argv stays None unless pip was started.
+    """
+
+    class FakeProcess:
+        argv = None
+        returncode = 0
+        stdout = b""
+        stderr = b""
 
         async def communicate(self):
-            return b"done", b""
+            return self.stdout, self.stderr
+
+    process = FakeProcess()
+
+    async def fake_exec(*argv, stderr=None, stdout=None):
+        process.argv = list(argv)
+        return process
 
-    async def fake_shell(command, stderr=None, stdout=None):
-        return DummyProcess(command)
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", fake_exec)
+    return process
 
-    monkeypatch.setattr(asyncio, "create_subprocess_shell", fake_shell)
 
+@pytest.mark.asyncio
+async def test_package_installer_pip_invocation(pip_process):
     tool = PackageInstallerTool()
     await tool.run(
         "somepackage",
@@ -133,11 +289,44 @@ async def test_package_installer_pip_invocation(monkeypatch):
         extension="pip",
     )
 
-    assert "--upgrade" in captured["command"]
-    assert '"somepackage==1.2.3"' in captured["command"]
+    assert pip_process.argv == [
+        sys.executable,
+        "-m",
+        "pip",
+        "install",
+        "somepackage==1.2.3",
+        "--upgrade",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_package_installer_pip_cache_dir(pip_process, tmp_path):
+    await PackageInstallerTool().run("somepackage", cache_dir=tmp_path, extension="pip")
+
+    assert pip_process.argv[-2:] == ["--cache-dir", str(tmp_path)]
+
+
+@pytest.mark.asyncio
+async def test_package_installer_pip_failure_raises(pip_process):
+    pip_process.returncode = 1
+    pip_process.stderr = b"ERROR: No matching distribution found"
+
+    with pytest.raises(ValueError, match="No matching distribution found"):
+        await PackageInstallerTool().run("somepackage", extension="pip")
+
+
+@pytest.mark.asyncio
+async def test_package_installer_pip_unavailable(monkeypatch, pip_process):
+    monkeypatch.setattr(packageinstaller, "_has_pip", lambda: False)
+
+    with pytest.raises(ValueError, match="pip is not available"):
+        await PackageInstallerTool().run("somepackage", extension="pip")
+
+    assert pip_process.argv is None
 
 
 if HAS_PYODIDE_TEST:
+    from pytest_pyodide import copy_files_to_pyodide, run_in_pyodide
 
     @copy_files_to_pyodide(
         file_list=[("src/asynctoolkit", "asynctoolkit")],
@@ -148,11 +337,13 @@ if HAS_PYODIDE_TEST:
     async def test_package_installer_extension_pyodide(selenium):
         from asynctoolkit.defaults.packageinstaller import PackageInstallerTool
 
-        await PackageInstallerTool().run("colorama", version="<0.4.6")
+        tool = PackageInstallerTool()
 
-        dist = importlib.metadata.distribution("colorama")
-        assert dist.version == "0.4.5", dist.version
+        async def install_and_check(version, expected, upgrade=False):
+            await tool.run("colorama", version=version, upgrade=upgrade)
+            installed = importlib.metadata.version("colorama")
+            assert installed == expected, installed
 
-        await PackageInstallerTool().run("colorama", version="==0.4.6", upgrade=True)
-        dist = importlib.metadata.distribution("colorama")
-        assert dist.version == "0.4.6", dist.version
+        # Both steps act on the same package, so they have to run in order.
+        await install_and_check("<0.4.6", "0.4.5")
+        await install_and_check("==0.4.6", "0.4.6", upgrade=True)